@@ -1,38 +1,69 @@
 import glob
-import json
+import io
 import pathlib
 import pickle
+import queue
 import shutil
 import subprocess
 import time
 import uuid
-import cv2
-import ffmpegcv
 import modal 
 import numpy as np
 from pydantic import BaseModel
 from fastapi import Depends, HTTPException
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 import os
-import pysubs2
-from supabase import create_client
 import asyncio
-from tqdm import tqdm
-import whisperx
-from google import genai
+
+# container-only imports, the local entrypoint only needs modal and the request model
+if not modal.is_local():
+    import aiofiles
+    import av
+    import cv2
+    import ffmpegcv
+    import httpx
+    import ijson
+    import orjson
+    import pysubs2
+    import torch
+    import whisperx
+    import whisperx.asr
+    import whisperx.audio
+    from google import genai
+    from google.genai import types
+    from supabase import AsyncClientOptions, acreate_client
+    from tqdm import tqdm
 
 class ProcessVideoRequest(BaseModel): 
     video_path: str
 
+# volume mount for caches that should survive between containers
+mount_path = "/root/.cache/torch"
+
+# keep compiled alignment kernels and cuda jit output on the volume so later cold starts reuse them
+compile_cache_env = {
+    "TORCHINDUCTOR_CACHE_DIR": f"{mount_path}/inductor",
+    "TRITON_CACHE_DIR": f"{mount_path}/triton",
+    "CUDA_CACHE_PATH": f"{mount_path}/nv/ComputeCache",
+}
+
 # setup environment on the server (modal)
 image = (modal.Image.from_registry(
     "nvidia/cuda:12.4.0-devel-ubuntu22.04", add_python="3.12")
     .apt_install(["ffmpeg", "libgl1-mesa-glx", "wget", "libcudnn8", "libcudnn8-dev"])
     .pip_install_from_requirements("requirements.txt")
+    # bake the model weights into the image, outside of the volume mount so they are not shadowed
+    .env({"HF_HOME": "/models/huggingface", "TORCH_HOME": "/models/torch"})
+    .run_commands(["python -c 'import whisperx; whisperx.load_model(\"large-v2\", device=\"cpu\", compute_type=\"float32\"); whisperx.load_align_model(language_code=\"en\", device=\"cpu\")'"])
+    # the weights are in the image now, keep huggingface from checking the hub on every cold start
+    .env({"HF_HUB_OFFLINE": "1"})
+    .env(compile_cache_env)
     .run_commands(["mkdir -p /usr/share/fonts/truetype/custom", 
                    "wget -O /usr/share/fonts/truetype/custom/Anton-Regular.ttf https://github.com/google/fonts/raw/main/ofl/anton/Anton-Regular.ttf", 
                    "fc-cache -f -v"])
-    .add_local_dir("asd", "/asd", copy=True))
+    .add_local_dir("asd", "/asd", copy=True)
+    # Columbia_test.py runs as a fresh process for every clip, ship its bytecode precompiled
+    .run_commands(["python -m compileall -q /asd"]))
 
 # initiate instance
 app = modal.App("podcast-clipper", image=image)
@@ -42,10 +73,125 @@ volume = modal.Volume.from_name(
     "podcast-clipper-model-cache", create_if_missing=True
 )
 
-mount_path = "/root/.cache/torch"
+# whisperx already splits audio with VAD and batches the ~30s chunks through
+# the model, 32 fits comfortably on the L40S and keeps the GPU busy
+whisper_batch_size = 32
+
+# int8 weights with float16 activations, halves the weight bandwidth of the decoder
+whisper_compute_type = "int8_float16"
 
 auth_scheme = HTTPBearer()
 
+download_chunk_size = 1 << 20
+
+gemini_model = "gemini-2.5-flash"
+
+# number of identified moments that get turned into clips per video
+max_clips = 1
+
+identify_moments_prompt = """
+This is a podcast video transcript consisting of word, along with each words's start and end time. I am looking to create clips between a minimum of 30 and maximum of 60 seconds long. The clip should never exceed 60 seconds.
+
+Your task is to find and extract stories, or question and their corresponding answers from the transcript.
+Each clip should begin with the question and conclude with the answer.
+It is acceptable for the clip to include a few additional sentences before a question if it aids in contextualizing the question.
+
+Please adhere to the following rules:
+- Ensure that clips do not overlap with one another.
+- Start and end timestamps of the clips should align perfectly with the sentence boundaries in the transcript.
+- Only use the start and end timestamps provided in the input. modifying timestamps is not allowed.
+- Format the output as a list of JSON objects, each representing a clip with 'start' and 'end' timestamps: [{"start": seconds, "end": seconds}, ...clip2, clip3]. The output should always be readable by the python json.loads function.
+- Aim to generate longer clips between 40-60 seconds, and ensure to include as much content from the context as viable.
+
+Avoid including:
+- Moments of greeting, thanking, or saying goodbye.
+- Non-question and answer interactions.
+
+If there are no valid clips to extract, the output should be an empty list [], in JSON format. Also readable by json.loads() in Python.
+"""
+
+def compile_cache_file_count() -> int:
+    return sum(len(files) for cache_dir in compile_cache_env.values() for _, _, files in os.walk(cache_dir))
+
+def log_mel_spectrogram_gpu(audio, n_mels: int = 80, padding: int = 0):
+    # same features as whisperx, but the stft and mel filter run on the gpu
+    return whisperx.audio.log_mel_spectrogram(audio, n_mels=n_mels, padding=padding, device="cuda")
+
+class DownloadStream(io.RawIOBase):
+    # file-like view of a download in progress, lets the audio decode start before the download ends
+    def __init__(self, max_chunks: int = 16):
+        self.chunks = queue.Queue(maxsize=max_chunks)
+        self.current = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    async def feed(self, chunk: bytes):
+        # wait for the decoder instead of buffering the whole video in memory
+        while not self.closed:
+            try:
+                self.chunks.put_nowait(chunk)
+                return
+            except queue.Full:
+                await asyncio.sleep(0.01)
+
+    async def finish(self):
+        await self.feed(None)
+
+    def close(self):
+        super().close()
+        # the decoder is done, free whatever it did not read
+        while True:
+            try:
+                self.chunks.get_nowait()
+            except queue.Empty:
+                break
+
+    def readinto(self, buffer):
+        while not self.current:
+            chunk = self.chunks.get()
+            if chunk is None:
+                self.chunks.put_nowait(None)
+                return 0
+            self.current = memoryview(chunk)
+
+        size = min(len(buffer), len(self.current))
+        buffer[:size] = self.current[:size]
+        self.current = self.current[size:]
+        return size
+
+def load_audio(video_path, sample_rate: int = 16000) -> np.ndarray:
+    # decode and resample in process instead of going through ffmpeg and a wav file
+    with av.open(video_path if isinstance(video_path, io.IOBase) else str(video_path)) as container:
+        stream = container.streams.audio[0]
+        resampler = av.AudioResampler(format="flt", layout="mono", rate=sample_rate)
+
+        duration = float(stream.duration * stream.time_base) if stream.duration else (container.duration or 0) / av.time_base
+        audio = np.empty(int(duration * sample_rate) + sample_rate, dtype=np.float32)
+        offset = 0
+
+        def append(frames):
+            nonlocal audio, offset
+            for frame in frames:
+                samples = frame.to_ndarray().reshape(-1)
+                if offset + len(samples) > len(audio):
+                    audio = np.resize(audio, max(len(audio) * 2, offset + len(samples)))
+                audio[offset:offset + len(samples)] = samples
+                offset += len(samples)
+
+        for frame in container.decode(stream):
+            append(resampler.resample(frame))
+        append(resampler.resample(None))
+
+    return audio[:offset]
+
+def load_audio_from_stream(stream: DownloadStream) -> np.ndarray:
+    try:
+        return load_audio(stream)
+    finally:
+        # stop buffering chunks once the decoder is done or gave up
+        stream.close()
+
 def create_vertical_video(tracks, scores, pyframes_path, pyavi_path, audio_path, output_path, framerate=25):
     target_width = 1080
     target_height = 1920
@@ -141,10 +287,11 @@ def create_vertical_video(tracks, scores, pyframes_path, pyavi_path, audio_path,
     if vout:
         vout.release()
 
-    ffmpeg_command = (f"ffmpeg -y -i {temp_video_path} -i {audio_path} "
-                      f"-c:v h264 -preset fast -crf 23 -c:a aac -b:a 128k "
-                      f"{output_path}")
-    subprocess.run(ffmpeg_command, shell=True, check=True, text=True)
+    ffmpeg_command = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+                      "-i", str(temp_video_path), "-i", str(audio_path),
+                      "-c:v", "h264", "-preset", "fast", "-crf", "23", "-c:a", "aac", "-b:a", "128k",
+                      str(output_path)]
+    subprocess.run(ffmpeg_command, check=True, text=True)
 
 def create_subtitles_with_ffmpeg(transcript_segments: list, clip_start: float, clip_end: float, clip_video_path: str, output_path: str, max_word: int): 
     temp_dir = os.path.dirname(output_path)
@@ -223,49 +370,90 @@ def create_subtitles_with_ffmpeg(transcript_segments: list, clip_start: float, c
     
     subs.save(subtitle_path)
 
-    ffmpeg_command = (f"ffmpeg -y -i {clip_video_path} -vf \"ass={subtitle_path}\" "
-                        f"-c:v h264 -preset fast -crf 23 {output_path}")
+    ffmpeg_command = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+                      "-i", str(clip_video_path), "-vf", f"ass={subtitle_path}",
+                      "-c:v", "h264", "-preset", "fast", "-crf", "23", str(output_path)]
 
-    subprocess.run(ffmpeg_command, shell=True, check=True)
+    subprocess.run(ffmpeg_command, check=True)
 
-@app.cls(gpu="L40S", timeout=900, retries=0, scaledown_window=20, secrets=[modal.Secret.from_name("podcast-clipper-secret")], volumes={mount_path: volume})
+@app.cls(gpu="L40S", timeout=900, retries=0, scaledown_window=600, min_containers=1, buffer_containers=1, enable_memory_snapshot=True, secrets=[modal.Secret.from_name("podcast-clipper-secret")], volumes={mount_path: volume})
+@modal.concurrent(max_inputs=4)
 class PodcastClipper: 
-    @modal.enter()
+    @modal.enter(snap=True)
+    def load_model_to_cpu(self): 
+        # runs before the memory snapshot, so only cpu state is allowed here
+        print("Loading alignment model to cpu")
+        self.alignment_model, self.metadata = whisperx.load_align_model(
+            language_code="en", 
+            device="cpu"
+        )
+
+    @modal.enter(snap=False)
     async def load_model(self): 
         # setup supabase client
         print("Creating supabase client")
         url = os.environ["SUPABASE_URL"]
         key = os.environ["SUPABASE_KEY"]
-        self.supabase = create_client(url, key)
+        # one long lived connection pool shared by the supabase client and the video downloads
+        self.http_client = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=32),
+            timeout=httpx.Timeout(60.0)
+        )
+        self.supabase = await acreate_client(url, key, options=AsyncClientOptions(httpx_client=self.http_client))
         self.bucket_name = os.environ["BUCKET_NAME"]
 
         # load whisper model 
         print("Loading whisper model")
-        self.whisperx_model = whisperx.load_model("large-v2", device="cuda", compute_type="float16")
-
-        self.alignment_model, self.metadata = whisperx.load_align_model(
-            language_code="en", 
-            device="cuda"
+        # english only, like the alignment model. this also skips language detection, which would
+        # hand the gpu features from the patched log_mel_spectrogram straight to the ctranslate2 encoder
+        self.whisperx_model = whisperx.load_model("large-v2", device="cuda", compute_type=whisper_compute_type, language="en")
+
+        # run the stft and mel filter of every batch on the gpu instead of the cpu
+        whisperx.asr.log_mel_spectrogram = log_mel_spectrogram_gpu
+
+        # alignment model was restored from the snapshot, move it to the gpu
+        self.alignment_model = self.alignment_model.to("cuda")
+
+        # segments have different lengths, so compile with dynamic shapes instead of cuda graphs
+        self.alignment_model = torch.compile(self.alignment_model, dynamic=True)
+
+        # warm up with a dummy 30s segment so the first request does not pay the compile cost
+        print("Warming up alignment model")
+        cached_files = compile_cache_file_count()
+        whisperx.align(
+            [{"start": 0.0, "end": 30.0, "text": "warm up"}],
+            self.alignment_model,
+            self.metadata,
+            np.zeros(30 * 16000, dtype=np.float32),
+            device="cuda",
+            return_char_alignments=False
         )
 
+        # persist the kernels compiled during warm up, nothing to do when they came from the volume
+        if compile_cache_file_count() != cached_files:
+            await volume.commit.aio()
+
         print("Transcription model loaded")
 
+        # requests run concurrently, but whisperx and the alignment model share the gpu
+        self.transcribe_lock = asyncio.Lock()
+
         # gemini client
         print("Creating gemini client...")
         self.gemini_client = genai.Client(api_key=os.environ["GEMINI_SECRET"])
         print("Created gemini client")
 
-    def transcribe_video(self, base_dir: str, video_path: str) -> str: 
-        audio_path = base_dir / "audio.wav"
-        extract_cmd = f"ffmpeg -i {video_path} -vn -acodec pcm_s16le -ar 16000 -ac 1 {audio_path}"
-        subprocess.run(extract_cmd, shell=True, check=True, capture_output=True)
+    @modal.exit()
+    async def close_clients(self):
+        await self.http_client.aclose()
 
+    def transcribe_video(self, audio: np.ndarray) -> str: 
         print("Starting transcription with WhisperX...")
 
         start_time = time.time()
 
-        audio = whisperx.load_audio(str(audio_path))
-        result = self.whisperx_model.transcribe(audio, batch_size=16)
+        result = self.whisperx_model.transcribe(audio, batch_size=whisper_batch_size, chunk_size=30)
 
         result = whisperx.align(
             result["segments"], 
@@ -279,45 +467,45 @@ class PodcastClipper:
         duration = time.time() - start_time
         print("Transcription and alignment took " + str(duration) + " seconds")
 
-        segments = []
-
-        if "word_segments" in result: 
-            for word_segment in result["word_segments"]: 
-                segments.append({
-                    "start": word_segment["start"], 
-                    "end": word_segment["end"], 
-                    "word": word_segment["word"]
-                })
+        # whisperx word timestamps are numpy.float64, which orjson does not serialize
+        segments = [
+            {"start": float(word_segment["start"]), "end": float(word_segment["end"]), "word": word_segment["word"]}
+            for word_segment in result.get("word_segments", ())
+        ]
 
-        return json.dumps(segments)
+        return orjson.dumps(segments).decode()
     
-    def identify_moments(self, transcript: dict): 
-        response = self.gemini_client.models.generate_content(
-            model="gemini-2.5-flash", 
-            contents="""
-     This is a podcast video transcript consisting of word, along with each words's start and end time. I am looking to create clips between a minimum of 30 and maximum of 60 seconds long. The clip should never exceed 60 seconds.
-
-    Your task is to find and extract stories, or question and their corresponding answers from the transcript.
-    Each clip should begin with the question and conclude with the answer.
-    It is acceptable for the clip to include a few additional sentences before a question if it aids in contextualizing the question.
-
-    Please adhere to the following rules:
-    - Ensure that clips do not overlap with one another.
-    - Start and end timestamps of the clips should align perfectly with the sentence boundaries in the transcript.
-    - Only use the start and end timestamps provided in the input. modifying timestamps is not allowed.
-    - Format the output as a list of JSON objects, each representing a clip with 'start' and 'end' timestamps: [{"start": seconds, "end": seconds}, ...clip2, clip3]. The output should always be readable by the python json.loads function.
-    - Aim to generate longer clips between 40-60 seconds, and ensure to include as much content from the context as viable.
-
-    Avoid including:
-    - Moments of greeting, thanking, or saying goodbye.
-    - Non-question and answer interactions.
-
-    If there are no valid clips to extract, the output should be an empty list [], in JSON format. Also readable by json.loads() in Python.
-
-    The transcript is as follows:\n\n""" + str(transcript))
-        
-        print(f"Identified moments response: {response.text}")
-        return response.text if response.text is not None else ""
+    def stream_response(self, contents: str):
+        # the instructions are sent as a fixed system_instruction on every request. at ~400 tokens they are
+        # below gemini's minimum size for both explicit and implicit caching, so they are not cached
+        return self.gemini_client.models.generate_content_stream(
+            model=gemini_model,
+            contents=contents,
+            config=types.GenerateContentConfig(
+                system_instruction=identify_moments_prompt,
+                response_mime_type="application/json"
+            )
+        )
+
+    def identify_moments(self, transcript: list): 
+        # compact json is smaller than the python repr and easier for the model to read
+        contents = "The transcript is as follows:\n\n" + orjson.dumps(transcript).decode()
+
+        # parse the json array while it streams in and yield each clip as soon as it is complete
+        moments = ijson.sendable_list()
+        parser = ijson.items_coro(moments, "item", use_float=True)
+        for chunk in self.stream_response(contents):
+            if chunk.text:
+                parser.send(chunk.text.encode())
+                for moment in moments:
+                    print(f"Identified moment: {moment}")
+                    yield moment
+                del moments[:]
+        parser.close()
+
+        for moment in moments:
+            print(f"Identified moment: {moment}")
+            yield moment
     
     def process_clip(self, base_dir: str, original_video_path: str, video_path: str, start_time: float, end_time: float, clip_index: int, transcript_segments: list):
         clip_name = f"clip_{clip_index}"
@@ -341,20 +529,24 @@ class PodcastClipper:
         pyavi_path.mkdir(exist_ok=True)
 
         duration = end_time - start_time
-        cut_command = (f"ffmpeg -i {original_video_path} -ss {start_time} -t {duration} "
-                        f"{clip_segment_path}")
-        subprocess.run(cut_command, shell=True, check=True, capture_output=True)
+        # seek on the input and decode with nvdec, ffmpeg falls back to software decoding if it is unavailable
+        cut_command = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-hwaccel", "cuda",
+                       "-ss", str(start_time), "-i", str(original_video_path), "-t", str(duration),
+                       str(clip_segment_path)]
+        subprocess.run(cut_command, check=True, capture_output=True)
 
-        extract_cmd = f"ffmpeg -i {clip_segment_path} -vn -acodec pcm_s16le -ar 16000 -ac 1 {audio_path}"
-        subprocess.run(extract_cmd, shell=True, check=True, capture_output=True)
+        extract_cmd = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-i", str(clip_segment_path),
+                       "-vn", "-acodec", "pcm_s16le", "-ar", "16000", "-ac", "1", "-threads", "4",
+                       str(audio_path)]
+        subprocess.run(extract_cmd, check=True, capture_output=True)
 
         shutil.copy(clip_segment_path, base_dir / f"{clip_name}.mp4")
 
-        columbia_command = (f"python Columbia_test.py --videoName {clip_name} "
-                            f"--videoFolder {str(base_dir)} "
-                            f"--pretrainModel weight/finetuning_TalkSet.model")
+        columbia_command = ["python", "Columbia_test.py", "--videoName", clip_name,
+                            "--videoFolder", str(base_dir),
+                            "--pretrainModel", "weight/finetuning_TalkSet.model"]
         columbia_start_time = time.time()
-        subprocess.run(columbia_command, cwd="/asd", shell=True, check=True, capture_output=True)
+        subprocess.run(columbia_command, cwd="/asd", check=True, capture_output=True)
         columbia_end_time = time.time()
         print(f"Columbia script completed in {columbia_end_time - columbia_start_time:.2f} seconds")
 
@@ -379,13 +571,57 @@ class PodcastClipper:
         # add subtitles 
         create_subtitles_with_ffmpeg(transcript_segments, start_time, end_time, vertical_mp4_path, subtitle_output_path, max_word=5)
 
-        with open(subtitle_output_path, "rb") as f:
-            response = (self.supabase.storage.from_(self.bucket_name).upload(
-                    file=f,
-                    path=video_path,
-                ))
+        return subtitle_output_path
+
+    async def create_clip(self, base_dir: str, original_video_path: str, video_path: str, start_time: float, end_time: float, clip_index: int, transcript_segments: list):
+        clip_path = await asyncio.to_thread(
+            self.process_clip, base_dir, original_video_path, video_path, start_time, end_time, clip_index, transcript_segments
+        )
+
+        with open(clip_path, "rb") as f:
+            await self.supabase.storage.from_(self.bucket_name).upload(
+                file=f,
+                path=video_path,
+            )
         print("the video has been uploaded to supabase")
 
+    async def download_video(self, remote_path: str, video_path: pathlib.Path, stream: DownloadStream = None):
+        # stream the video to disk in chunks instead of holding the whole file in memory
+        signed = await self.supabase.storage.from_(self.bucket_name).create_signed_url(remote_path, 3600)
+
+        download_start_time = time.time()
+        async with self.http_client.stream("GET", signed["signedURL"]) as response:
+            response.raise_for_status()
+            async with aiofiles.open(video_path, "wb") as f:
+                async for chunk in response.aiter_bytes(download_chunk_size):
+                    await f.write(chunk)
+                    if stream is not None:
+                        await stream.feed(chunk)
+        print(f"Video downloaded in {time.time() - download_start_time:.2f} seconds")
+
+    async def download_audio(self, remote_path: str, video_path: pathlib.Path) -> np.ndarray:
+        # download the video, decoding the audio track while the download is in progress
+        stream = DownloadStream()
+        decode_task = asyncio.create_task(asyncio.to_thread(load_audio_from_stream, stream))
+        try:
+            await self.download_video(remote_path, video_path, stream)
+        finally:
+            await stream.finish()
+            # the decoder stops at the end of the stream, always collect its result so its errors are not lost
+            audio, = await asyncio.gather(decode_task, return_exceptions=True)
+
+        if isinstance(audio, av.error.FFmpegError):
+            print(f"Could not decode audio while downloading: {audio}")
+            audio = None
+        elif isinstance(audio, BaseException):
+            raise audio
+
+        if audio is None or len(audio) == 0:
+            # e.g. mp4 with the moov atom at the end, which needs a seekable file
+            audio = await asyncio.to_thread(load_audio, video_path)
+
+        return audio
+
     @modal.fastapi_endpoint(method="POST")
     async def process_video(self, request: ProcessVideoRequest, token: HTTPAuthorizationCredentials = Depends(auth_scheme)):
         print("processing videos " + request.video_path)
@@ -397,49 +633,61 @@ class PodcastClipper:
         base_dir = pathlib.Path("/tmp") / run_id
         base_dir.mkdir(parents=True, exist_ok=True)
 
-        # download video file
-        video_path = base_dir / "input.mp4"
-        with open(video_path, "wb+") as f: 
-            response = await asyncio.to_thread(
-                self.supabase.storage.from_(self.bucket_name).download,
-                request.video_path,
-            )
-            f.write(response)
-
-        # transcribe the video
-        transcript_segments_json = self.transcribe_video(base_dir, video_path)
-        transcript_segments = json.loads(transcript_segments_json)
-
-        # identify moments for clips
-        print("Identifying moments...")
-        identified_moments_raw = self.identify_moments(transcript_segments)
-
-        cleaned_json_string = identified_moments_raw.strip()
-        if cleaned_json_string.startswith("```json"): 
-            cleaned_json_string = cleaned_json_string[len("```json"):].strip()
-        if cleaned_json_string.endswith("```"): 
-            cleaned_json_string = cleaned_json_string[:-len("```")].strip()
-
-        clip_moments = json.loads(cleaned_json_string)
-        if not clip_moments or not isinstance(clip_moments, list): 
-            print("Error identifying moments as a list")
-            clip_moments = []
-
-        print(clip_moments)
-
-        # processing clip moments
-        for index, moment in enumerate(clip_moments[:1]): 
-            if "start" in moment and "end" in moment: 
-                print("Processing clip " + str(index) + " from " + str(moment["start"]) + " to " + str(moment["end"]))
-                original_remote_path = pathlib.Path(request.video_path)
-                clip_remote_path = original_remote_path.parent / f"clip_{index}.mp4"
-                self.process_clip(base_dir, video_path, str(clip_remote_path), moment["start"], moment["end"], index, transcript_segments)
-
-        
-        # cleaning up 
-        if base_dir.exists(): 
-            print("Cleaning up temp directory after " + str(base_dir))
-            shutil.rmtree(base_dir, ignore_errors=True)
+        try:
+            video_path = base_dir / "input.mp4"
+            audio = await self.download_audio(request.video_path, video_path)
+
+            # transcribe the video, one request at a time on the gpu
+            async with self.transcribe_lock:
+                transcription = asyncio.create_task(asyncio.to_thread(self.transcribe_video, audio))
+                try:
+                    transcript_segments_json = await asyncio.shield(transcription)
+                except asyncio.CancelledError:
+                    # the worker thread keeps running on the gpu, hold the lock until it is done
+                    await asyncio.gather(transcription, return_exceptions=True)
+                    raise
+            transcript_segments = orjson.loads(transcript_segments_json)
+
+            # identify moments for clips, each clip starts processing as soon as gemini streams it
+            print("Identifying moments...")
+            moments = self.identify_moments(transcript_segments)
+            clip_tasks = []
+            try:
+                while len(clip_tasks) < max_clips:
+                    moment = await asyncio.to_thread(next, moments, None)
+                    if moment is None:
+                        break
+                    if isinstance(moment, dict) and "start" in moment and "end" in moment: 
+                        index = len(clip_tasks)
+                        print("Processing clip " + str(index) + " from " + str(moment["start"]) + " to " + str(moment["end"]))
+                        original_remote_path = pathlib.Path(request.video_path)
+                        clip_remote_path = original_remote_path.parent / f"clip_{index}.mp4"
+                        clip_tasks.append(asyncio.create_task(self.create_clip(
+                            base_dir, video_path, str(clip_remote_path), moment["start"], moment["end"], index, transcript_segments
+                        )))
+            finally:
+                try:
+                    # stops the gemini stream once enough clips were found
+                    moments.close()
+                except ValueError:
+                    # a cancelled request can leave next() running in its worker thread,
+                    # the generator then ends on its own with the gemini stream
+                    pass
+
+                # cancelling would not stop the worker threads, wait for the clips before the temp dir is removed
+                clip_results = await asyncio.gather(*clip_tasks, return_exceptions=True)
+
+            if not clip_tasks:
+                print("No clip moments identified")
+
+            for result in clip_results:
+                if isinstance(result, BaseException):
+                    raise result
+        finally:
+            # cleaning up 
+            if base_dir.exists(): 
+                print("Cleaning up temp directory after " + str(base_dir))
+                shutil.rmtree(base_dir, ignore_errors=True)
 
 # entrypoint        
 @app.local_entrypoint()